@@ -3,6 +3,7 @@ from db import run_hr_query
 from yandex_cloud_ml_sdk import YCloudML
 from visualizer import visualize_with_matplotlib
 from telegram import send_table_as_file
+from sql_repair import run_with_repair, REPAIR_MAX_ATTEMPTS, UNDEFINED_COLUMN, TYPE_MISMATCH, INVALID_DATE
 import os
 import datetime
 import re
@@ -79,6 +80,43 @@ def extract_sql(text: str) -> str | None:
     return None
 
 
+_REPAIR_HINTS = {
+    UNDEFINED_COLUMN: "Используй только колонки из списка ниже, алиасы из SELECT нельзя использовать в WHERE.",
+    TYPE_MISMATCH: "Не сравнивай DATE с числами и строками: используй EXTRACT(YEAR FROM ...) или DATE_TRUNC.",
+    INVALID_DATE: "Даты пиши литералами в формате 'YYYY-MM-DD'.",
+}
+
+
+def repair_sql_with_llm(sql: str, error: str, category: str | None, timeout: float) -> str | None:
+    """
+    Короткий промпт на починку SQL по тексту ошибки Postgres.
+    Возвращает исправленный SQL или None.
+    """
+    columns = ", ".join(f"{k} ({v.split()[0]})" for k, v in SCHEMA.items())
+    prompt = f"""
+Исправь SQL-запрос к таблице hr_data (PostgreSQL).
+{_REPAIR_HINTS.get(category, "")}
+fire_from_company = '1970-01-01' — сотрудник работает; уволенные — fire_from_company > '1971-01-01'.
+
+Колонки: {columns}
+
+Запрос:
+{sql}
+
+Ошибка:
+{error}
+
+Верни только исправленный SQL SELECT без пояснений.
+"""
+
+    model = llm.configure(temperature=0.0, max_tokens=500)
+    result = model.run(prompt, timeout=timeout)
+    fixed = extract_sql(result.alternatives[0].text.strip())
+    if not fixed or not validate_sql(fixed):
+        return None
+    return fixed
+
+
 def make_filename(user_message: str) -> str:
     date_str = datetime.date.today().isoformat()
     name = "analytics"
@@ -95,7 +133,18 @@ def make_filename(user_message: str) -> str:
     return f"{name}_{date_str}.csv"
 
 
-def run_analyst(thread_id: str, user_message: str, chat_id: str) -> dict:
+def run_analyst(thread_id: str, user_message: str, chat_id: str, on_progress=None) -> dict:
+    """
+    on_progress(text) — необязательный колбэк, получает этапы работы
+    (SQL готов → починка запроса → данные получены → строим график) для показа пользователю.
+    """
+    def progress(text: str):
+        if on_progress:
+            try:
+                on_progress(text)
+            except Exception as e:
+                print("Progress callback failed:", e)
+
     try:
         # --- История чата ---
         history = get_chat_history(thread_id, limit=5)
@@ -181,24 +230,37 @@ def run_analyst(thread_id: str, user_message: str, chat_id: str) -> dict:
         if not validate_sql(sql):
             return {"type": "error", "text": f"⚠️ Запрос отклонён как небезопасный:\n{sql}", "image": None}
 
-        # --- Выполнение SQL ---
-        try:
-            rows = run_hr_query(sql)
-        except Exception as db_err:
+        progress("🧮 SQL готов, выполняю запрос...")
+
+        # --- Выполнение SQL (с автоматической починкой) ---
+        run = run_with_repair(
+            sql,
+            run_hr_query,
+            SCHEMA,
+            llm_fix=repair_sql_with_llm,
+            on_attempt=lambda attempt, _category: progress(
+                f"🛠 Запрос упал, исправляю (попытка {attempt}/{REPAIR_MAX_ATTEMPTS})..."
+            ),
+        )
+        sql, rows = run["sql"], run["rows"]
+        if run["error"]:
             return {
                 "type": "error",
-                "text": f"⚠️ Ошибка при выполнении SQL:\n{sql}\n\nОшибка: {db_err}",
+                "text": f"⚠️ Ошибка при выполнении SQL:\n{sql}\n\nОшибка: {run['error']}",
                 "image": None,
             }
 
         if not rows:
             return {"type": "result", "text": "⚠️ Данных нет.", "image": None}
 
+        progress(f"📥 Получено строк: {len(rows)}, отправляю таблицу...")
+
         # --- Отправляем результат таблицей (CSV) ---
         filename = make_filename(user_message)
         send_table_as_file(chat_id, rows, filename=filename)
 
         # --- Визуализация ---
+        progress("📈 Строю график...")
         img = None
         try:
             img = visualize_with_matplotlib(
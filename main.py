@@ -1,6 +1,7 @@
 import json
 import os
-from telegram import send_message, send_photo
+import time
+from telegram import send_message, send_photo, LiveMessage
 from logger import save_message, start_thread, get_chat_history
 from analyst import run_analyst
 from yandex_cloud_ml_sdk import YCloudML
@@ -25,6 +26,16 @@ def _log(label, obj):
         print(label, str(obj)[:3000])
 
 
+def _log_timing(route: str, live: LiveMessage, started: float):
+    """Время до первого контента (ttfc) и полное время ответа, мс."""
+    _log("timing", {
+        "route": route,
+        "chat_id": live.chat_id,
+        "ttfc_ms": live.ttfc_ms,
+        "total_ms": int((time.monotonic() - started) * 1000),
+    })
+
+
 def decide_action(user_message: str) -> str:
     """
     GPT решает: нужно SQL (Analyst) или обычный ответ (Chat).
@@ -52,9 +63,10 @@ def decide_action(user_message: str) -> str:
     return "SQL" if "SQL" in decision else "CHAT"
 
 
-def chat_with_gpt(thread_id: str, user_message: str) -> str:
+def chat_with_gpt(thread_id: str, user_message: str, on_partial=None) -> str:
     """
     Диалоговый ассистент (YandexGPT), использует историю.
+    Ответ стримится: on_partial(text) получает накопленный текст по мере генерации.
     """
     history = get_chat_history(thread_id, limit=6)
 
@@ -72,11 +84,36 @@ def chat_with_gpt(thread_id: str, user_message: str) -> str:
     """
 
     model = dialog_llm.configure(temperature=0.5, max_tokens=300)
-    result = model.run(system_prompt)
-    return result.alternatives[0].text.strip()
+    text = ""
+    for result in model.run_stream(system_prompt):
+        # YandexGPT в стриме отдаёт весь текст, накопленный к этому моменту
+        text = result.alternatives[0].text
+        if on_partial:
+            try:
+                on_partial(text)
+            except Exception as e:
+                print("Partial callback failed:", e)
+    return text.strip()
+
+
+def reply_with_analyst(thread_id: str, chat_id: str, text: str, live: LiveMessage):
+    """
+    Запускаем аналитика, показывая этапы в live-сообщении, и отправляем итог.
+    """
+    # Этапы приходят редко и перед долгими шагами — показываем их сразу, без дебаунса
+    result = run_analyst(thread_id, text, chat_id, on_progress=lambda stage: live.update(stage, force=True))
+
+    if result["type"] in ("clarification", "result"):
+        save_message(thread_id, chat_id, "assistant", result["text"], "analyst")
+    live.finish(result["text"])
+
+    if result["type"] == "result" and result["image"]:
+        send_photo(chat_id, result["image"], "Визуализация 📈")
 
 
 def handler(event, context):
+    started = time.monotonic()
+
     # ---------- Healthcheck ----------
     if (event or {}).get("httpMethod") == "GET":
         return {"statusCode": 200, "headers": {"Content-Type": "text/plain"}, "body": "ok"}
@@ -127,42 +164,25 @@ def handler(event, context):
             send_message(chat_id, reply)
 
         elif text.startswith("/db"):
-            result = run_analyst(thread_id, text, chat_id)
-
-            if result["type"] == "clarification":
-                save_message(thread_id, chat_id, "assistant", result["text"], "analyst")
-                send_message(chat_id, result["text"])
-            elif result["type"] == "result":
-                save_message(thread_id, chat_id, "assistant", result["text"], "analyst")
-                send_message(chat_id, result["text"])
-                if result["image"]:
-                    send_photo(chat_id, result["image"], "Визуализация 📈")
-            else:
-                send_message(chat_id, result["text"])
+            live = LiveMessage(chat_id, started=started)
+            reply_with_analyst(thread_id, chat_id, text, live)
+            _log_timing("db", live, started)
 
         else:
             # --- GPT решает, звать ли аналитика ---
             action = decide_action(text)
 
             if action == "SQL":
-                send_message(chat_id, "Генерирую аналитику... 📊")
-                result = run_analyst(thread_id, text, chat_id)
-
-                if result["type"] == "clarification":
-                    save_message(thread_id, chat_id, "assistant", result["text"], "analyst")
-                    send_message(chat_id, result["text"])
-                elif result["type"] == "result":
-                    save_message(thread_id, chat_id, "assistant", result["text"], "analyst")
-                    send_message(chat_id, result["text"])
-                    if result["image"]:
-                        send_photo(chat_id, result["image"], "Визуализация 📈")
-                else:
-                    send_message(chat_id, result["text"])
+                live = LiveMessage(chat_id, started=started, placeholder="Генерирую аналитику... 📊")
+                reply_with_analyst(thread_id, chat_id, text, live)
+                _log_timing("analyst", live, started)
 
             else:
-                reply = chat_with_gpt(thread_id, text)
+                live = LiveMessage(chat_id, started=started)
+                reply = chat_with_gpt(thread_id, text, on_partial=live.update)
+                live.finish(reply)
                 save_message(thread_id, chat_id, "assistant", reply, "main")
-                send_message(chat_id, reply)
+                _log_timing("chat", live, started)
 
         return {"statusCode": 200, "body": "ok"}
 
@@ -0,0 +1,343 @@
+import calendar
+import difflib
+import os
+import re
+import time
+from psycopg2 import errorcodes
+
+# --- Бюджет на починку одного запроса ---
+REPAIR_MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", 3))
+REPAIR_MAX_SECONDS = float(os.getenv("SQL_REPAIR_MAX_SECONDS", 20))
+
+# Дата-заглушка в fire_from_company: сотрудник всё ещё работает
+NOT_FIRED_DATE = "1970-01-01"
+FIRED_AFTER_DATE = "1971-01-01"
+
+# --- Классы ошибок по SQLSTATE ---
+UNDEFINED_COLUMN = "undefined_column"
+TYPE_MISMATCH = "type_mismatch"
+INVALID_DATE = "invalid_date"
+
+_CATEGORIES = {
+    errorcodes.UNDEFINED_COLUMN: UNDEFINED_COLUMN,
+    errorcodes.DATATYPE_MISMATCH: TYPE_MISMATCH,
+    errorcodes.UNDEFINED_FUNCTION: TYPE_MISMATCH,  # operator does not exist: date = integer
+    errorcodes.INVALID_DATETIME_FORMAT: INVALID_DATE,
+    errorcodes.DATETIME_FIELD_OVERFLOW: INVALID_DATE,
+}
+
+_OPS = r"(>=|<=|<>|!=|=|>|<)"
+
+# Имя колонки считаем опечаткой, только если оно достаточно похоже на одну колонку
+COLUMN_MATCH_CUTOFF = 0.8
+
+# Ключевые слова и функции SQL — это не опечатки в колонках, такие случаи отдаём LLM
+_SQL_WORDS = {
+    "select", "distinct", "from", "where", "group", "order", "by", "having", "limit",
+    "as", "and", "or", "not", "null", "is", "in", "between", "like", "case", "when",
+    "then", "else", "end", "over", "partition", "filter", "cast", "interval",
+    "count", "sum", "avg", "min", "max", "round", "coalesce", "nullif",
+    "extract", "date_trunc", "date_part", "age", "now", "current_date",
+    "year", "month", "day", "week", "quarter", "hour", "minute", "second", "epoch",
+    "date", "dow", "doy",
+}
+
+# Успешные починки: упавший SQL -> исправленный, и выученные замены колонок
+_repaired: dict[str, str] = {}
+_column_fixes: dict[str, str] = {}
+
+
+def _key(sql: str) -> str:
+    # Регистр не трогаем: 'Доставка' и 'доставка' для Postgres — разные значения
+    return " ".join(sql.split()).rstrip(";")
+
+
+def classify_error(err: Exception) -> str | None:
+    """
+    Класс ошибки по SQLSTATE (pgcode) или None, если чинить локально нечего.
+    """
+    return _CATEGORIES.get(getattr(err, "pgcode", None))
+
+
+def _error_text(err: Exception) -> str:
+    return (getattr(err, "pgerror", None) or str(err)).strip()
+
+
+def _date_columns(schema: dict) -> list[str]:
+    return [col for col, desc in schema.items() if desc.startswith("DATE")]
+
+
+def _outside_literals(sql: str, func) -> str:
+    """
+    Применяем func только к частям SQL вне строковых литералов '...'.
+    """
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    return "".join(part if i % 2 else func(part) for i, part in enumerate(parts))
+
+
+def _replace_column(sql: str, bad: str, good: str) -> str:
+    return _outside_literals(sql, lambda part: re.sub(rf'"?\b{re.escape(bad)}\b"?', good, part))
+
+
+def _defines_alias(sql: str, name: str) -> bool:
+    """
+    Задан ли name как алиас в запросе: через AS или без него (COUNT(*) hires, ...).
+    """
+    name_re = rf'"?{re.escape(name)}"?(?!\w)'
+    if re.search(rf"\bAS\s+{name_re}", sql, flags=re.I):
+        return True
+    # Без AS: перед именем стоит выражение, после — запятая или FROM
+    for match in re.finditer(rf"(\)|'|\b(\w+))\s+{name_re}\s*(?=,|\bFROM\b)", sql, flags=re.I):
+        prev = match.group(2)
+        if prev is None or prev.lower() not in _SQL_WORDS:
+            return True
+    return False
+
+
+def _closest_column(name: str, schema: dict) -> str | None:
+    """
+    Единственная колонка схемы, похожая на name. None — если похожих нет
+    или несколько подходят одинаково хорошо (department -> department_3..6).
+    """
+    name = name.lower()
+    if name in _SQL_WORDS:
+        return None
+    scored = sorted(
+        ((difflib.SequenceMatcher(None, name, col).ratio(), col) for col in schema),
+        reverse=True,
+    )
+    if not scored or scored[0][0] < COLUMN_MATCH_CUTOFF:
+        return None
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        return None
+    return scored[0][1]
+
+
+def _column_fix(sql: str, message: str, schema: dict) -> tuple[str, str] | None:
+    """
+    Пара (неизвестное имя, колонка схемы) для ошибки undefined column или None.
+    """
+    match = re.search(r'column "?([\w.]+)"? does not exist', message)
+    if not match:
+        return None
+    bad = match.group(1).split(".")[-1]
+
+    # Алиас из SELECT в WHERE — не опечатка в колонке, это оставляем LLM
+    if _defines_alias(sql, bad):
+        return None
+
+    good = _column_fixes.get(bad) or _closest_column(bad, schema)
+    if not good:
+        return None
+    return bad, good
+
+
+def _fix_undefined_column(sql: str, message: str, schema: dict) -> str | None:
+    pair = _column_fix(sql, message, schema)
+    if not pair:
+        return None
+    fixed = _replace_column(sql, *pair)
+    return fixed if fixed != sql else None
+
+
+def _column_re(col: str) -> str:
+    """Колонка с необязательным префиксом таблицы (h.hire_to_company) — группа 1."""
+    return rf"(?<![\w.])((?:\w+\.)?{col})\b"
+
+
+def _year_to_extract(sql: str, schema: dict) -> str:
+    """
+    hire_to_company >= 2023  ->  EXTRACT(YEAR FROM hire_to_company) >= 2023
+    """
+    for col in _date_columns(schema):
+        # Префикс таблицы уходит внутрь EXTRACT
+        column = _column_re(col)
+        sql = re.sub(
+            rf"{column}\s*{_OPS}\s*'?(\d{{4}})'?(?![\d-])",
+            r"EXTRACT(YEAR FROM \1) \2 \3",
+            sql,
+            flags=re.I,
+        )
+        sql = re.sub(
+            rf"{column}\s+BETWEEN\s+'?(\d{{4}})'?\s+AND\s+'?(\d{{4}})'?(?![\d-])",
+            r"EXTRACT(YEAR FROM \1) BETWEEN \2 AND \3",
+            sql,
+            flags=re.I,
+        )
+    return sql
+
+
+def _replace_date_literal(sql: str, schema: dict, literal: str, good: str) -> str:
+    """
+    Меняем литерал только там, где он сравнивается с DATE-колонкой.
+    """
+    for col in _date_columns(schema):
+        column = _column_re(col)
+        for pattern in (
+            rf"({column}\s*{_OPS}\s*){literal}",
+            rf"({column}\s+BETWEEN\s+){literal}",
+            rf"({column}\s+BETWEEN\s+'(?:[^']|'')*'\s+AND\s+){literal}",
+        ):
+            sql = re.sub(pattern, lambda m: f"{m.group(1)}'{good}'", sql, flags=re.I)
+    return sql
+
+
+def _fix_type_mismatch(sql: str, message: str, schema: dict) -> str | None:
+    if "date" not in message.lower():
+        return None
+    fixed = _year_to_extract(sql, schema)
+    return fixed if fixed != sql else None
+
+
+def _normalize_date(value: str) -> str | None:
+    """
+    Приводим литерал даты к 'YYYY-MM-DD'. None — если не понимаем формат.
+    """
+    value = value.strip()
+    if value.lower() in ("", "0", "null", "none", "0000-00-00"):
+        return NOT_FIRED_DATE
+
+    match = re.fullmatch(r"(\d{4})-(\d{1,2})", value)
+    if match:
+        return f"{match.group(1)}-{int(match.group(2)):02d}-01"
+
+    match = re.fullmatch(r"(\d{1,2})[./](\d{1,2})[./](\d{4})", value)
+    if match:
+        day, month, year = match.groups()
+        value = f"{year}-{month}-{day}"
+
+    match = re.fullmatch(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})", value)
+    if match:
+        year, month, day = (int(part) for part in match.groups())
+        if not 1 <= month <= 12:
+            return None
+        day = min(max(day, 1), calendar.monthrange(year, month)[1])
+        return f"{year:04d}-{month:02d}-{day:02d}"
+
+    return None
+
+
+def _fix_invalid_date(sql: str, message: str, schema: dict) -> str | None:
+    match = re.search(r'(?:type date|out of range): "([^"]*)"', message)
+    if not match:
+        return None
+    bad = match.group(1)
+    literal = re.escape(f"'{bad}'")
+
+    good = _normalize_date(bad)
+
+    # Правило 1970-01-01: «не уволен» — это заглушка, а не NULL/пустая строка
+    if good == NOT_FIRED_DATE:
+        fixed = re.sub(
+            rf"\bfire_from_company\s*(<>|!=)\s*{literal}",
+            f"fire_from_company > '{FIRED_AFTER_DATE}'",
+            sql,
+            flags=re.I,
+        )
+        fixed = re.sub(
+            rf"\bfire_from_company\s*=\s*{literal}",
+            f"fire_from_company = '{NOT_FIRED_DATE}'",
+            fixed,
+            flags=re.I,
+        )
+        if fixed != sql:
+            return fixed
+
+    if re.fullmatch(r"\d{4}", bad):
+        fixed = _year_to_extract(sql, schema)
+        return fixed if fixed != sql else None
+
+    if not good or good == bad:
+        return None
+    fixed = _replace_date_literal(sql, schema, literal, good)
+    return fixed if fixed != sql else None
+
+
+_LOCAL_FIXES = {
+    UNDEFINED_COLUMN: _fix_undefined_column,
+    TYPE_MISMATCH: _fix_type_mismatch,
+    INVALID_DATE: _fix_invalid_date,
+}
+
+
+def apply_known_fixes(sql: str) -> str:
+    """
+    Применяем уже найденные починки до первого запуска, чтобы не повторять ошибку.
+    """
+    if _key(sql) in _repaired:
+        return _repaired[_key(sql)]
+    for bad, good in _column_fixes.items():
+        if not _defines_alias(sql, bad):
+            sql = _replace_column(sql, bad, good)
+    return sql
+
+
+def local_fix(sql: str, err: Exception, schema: dict) -> str | None:
+    """
+    Детерминированная починка SQL по классу ошибки. None — если не получилось.
+    """
+    fix = _LOCAL_FIXES.get(classify_error(err))
+    if not fix:
+        return None
+    return fix(sql, _error_text(err), schema)
+
+
+def run_with_repair(sql: str, run_query, schema: dict, llm_fix=None, on_attempt=None) -> dict:
+    """
+    Выполняем SQL, при ошибке чиним: сначала локально, потом через llm_fix.
+    llm_fix(sql, error_text, category, timeout) -> str | None.
+    on_attempt(attempt, category) вызывается перед каждой попыткой починки.
+    Возвращает {"sql", "rows", "error", "attempts"}; error — последняя ошибка БД или None.
+    """
+    original = sql
+    sql = apply_known_fixes(sql)
+    deadline = time.monotonic() + REPAIR_MAX_SECONDS
+    tried = {_key(sql)}
+    learned: dict[str, str] = {}
+    attempts = 0
+
+    while True:
+        try:
+            rows = run_query(sql)
+        except Exception as err:
+            last_err = err
+        else:
+            # Запоминаем только починки, после которых запрос выполнился
+            if attempts and _key(original) != _key(sql):
+                _repaired[_key(original)] = sql
+                _column_fixes.update(learned)
+                print("SQL исправлен:", sql)
+            return {"sql": sql, "rows": rows, "error": None, "attempts": attempts}
+
+        # Чиним только ошибки самого запроса, а не соединения
+        if not getattr(last_err, "pgcode", None):
+            break
+        if attempts >= REPAIR_MAX_ATTEMPTS or time.monotonic() >= deadline:
+            break
+        attempts += 1
+
+        category = classify_error(last_err)
+        print(f"Починка SQL #{attempts} ({category or last_err.pgcode}):", _error_text(last_err))
+        if on_attempt:
+            on_attempt(attempts, category)
+
+        fixed = local_fix(sql, last_err, schema)
+        if fixed and category == UNDEFINED_COLUMN:
+            bad, good = _column_fix(sql, _error_text(last_err), schema)
+            learned[bad] = good
+        if (not fixed or _key(fixed) in tried) and llm_fix:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                fixed = llm_fix(sql, _error_text(last_err), category, remaining)
+            except Exception as e:
+                print("LLM repair failed:", e)
+                fixed = None
+
+        if not fixed or _key(fixed) in tried:
+            break
+        tried.add(_key(fixed))
+        sql = fixed
+
+    return {"sql": sql, "rows": None, "error": last_err, "attempts": attempts}
@@ -2,8 +2,14 @@ import requests
 import csv
 import io
 import os
+import time
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Минимальный интервал между правками одного сообщения (лимиты Telegram ~1 в секунду на чат)
+EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", 1.0))
+# Сколько finish() готов ждать перед финальной правкой, дальше — отдельное сообщение
+FINISH_MAX_WAIT = float(os.getenv("TELEGRAM_FINISH_MAX_WAIT", 3.0))
+MAX_TEXT_LEN = 4096
 
 
 def _check_response(resp):
@@ -28,6 +34,119 @@ def send_message(chat_id, text, parse_mode=None):
     return _check_response(resp)
 
 
+def edit_message_text(chat_id, message_id, text, parse_mode=None):
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/editMessageText"
+    payload = {"chat_id": chat_id, "message_id": message_id, "text": text}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    resp = requests.post(url, json=payload)
+    if resp.status_code == 429:
+        # Слишком часто правим — Telegram говорит, сколько подождать
+        try:
+            data = resp.json()
+        except Exception:
+            data = {}
+        retry_after = (data.get("parameters") or {}).get("retry_after", 1)
+        return {"ok": False, "error": "Too Many Requests", "retry_after": retry_after}
+    return _check_response(resp)
+
+
+class LiveMessage:
+    """
+    Сообщение, которое дописывается по ходу работы: первое обновление отправляет
+    сообщение, следующие правят его через editMessageText не чаще EDIT_INTERVAL.
+    Промежуточный текст, пришедший слишком рано, откладывается до следующего
+    обновления или finish(). Заодно меряем время до первого контента.
+    """
+
+    def __init__(self, chat_id, started: float | None = None, placeholder: str | None = None):
+        self.chat_id = chat_id
+        self.started = started or time.monotonic()
+        self.first_content_at = None
+        self.message_id = None
+        self._shown = None
+        self._pending = None
+        self._next_edit_at = 0.0
+        self._retry_at = 0.0  # бэкофф после 429, его не обходит даже force
+        if placeholder:
+            self._show(placeholder)
+
+    @property
+    def ttfc_ms(self) -> int | None:
+        """Время от начала запроса до первого содержательного текста, мс."""
+        if self.first_content_at is None:
+            return None
+        return int((self.first_content_at - self.started) * 1000)
+
+    def _show(self, text: str) -> bool:
+        text = text[:MAX_TEXT_LEN]
+        if text == self._shown:
+            return True
+
+        if self.message_id is None:
+            data = send_message(self.chat_id, text)
+            if data.get("ok"):
+                self.message_id = data["result"]["message_id"]
+        else:
+            data = edit_message_text(self.chat_id, self.message_id, text)
+
+        now = time.monotonic()
+        if not data.get("ok"):
+            self._next_edit_at = now + data.get("retry_after", EDIT_INTERVAL)
+            if "retry_after" in data:
+                self._retry_at = self._next_edit_at
+            return False
+        self._shown = text
+        self._next_edit_at = now + EDIT_INTERVAL
+        return True
+
+    def _show_content(self, text: str) -> bool:
+        shown = self._show(text)
+        if shown and self.first_content_at is None:
+            self.first_content_at = time.monotonic()
+        return shown
+
+    def update(self, text: str, force: bool = False):
+        """
+        Показываем text, если прошёл EDIT_INTERVAL, иначе откладываем.
+        force=True — не ждать EDIT_INTERVAL (редкие этапы, которые нельзя потерять),
+        но бэкофф после 429 соблюдается всегда.
+        """
+        text = (text or "").strip()
+        if not text:
+            return
+        self._pending = text
+        now = time.monotonic()
+        if now < self._retry_at:
+            return
+        # После неудачной отправки первого сообщения тоже ждём интервал
+        if force or now >= self._next_edit_at:
+            if self._show_content(text):
+                self._pending = None
+
+    def finish(self, text: str | None = None):
+        """
+        Финальный текст показываем всегда. Ждём окончания лимита не дольше
+        FINISH_MAX_WAIT, иначе отправляем итог отдельным сообщением.
+        """
+        text = (text or self._pending or "").strip()
+        if not text:
+            return
+        wait = self._next_edit_at - time.monotonic()
+        if self.message_id is not None and wait > 0:
+            if wait > FINISH_MAX_WAIT:
+                send_message(self.chat_id, text[:MAX_TEXT_LEN])
+                self.first_content_at = self.first_content_at or time.monotonic()
+                self._pending = None
+                return
+            time.sleep(wait)
+        if not self._show_content(text) and self.message_id is not None:
+            # Правка не прошла — отправляем отдельным сообщением, чтобы ответ не потерялся
+            send_message(self.chat_id, text[:MAX_TEXT_LEN])
+            self.first_content_at = self.first_content_at or time.monotonic()
+        self._pending = None
+
+
 def send_photo(chat_id, photo_bytes, caption=None):
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendPhoto"
     files = {"photo": ("image.png", photo_bytes, "image/png")}